@@ -0,0 +1,20 @@
+''' Shared setup of the tests: make tga2dds importable from the tests folder,
+without Wand if it is not installed as conversions are stubbed by the tests '''
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import wand.image
+except ImportError:
+    class Image:
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError('Wand is not installed')
+
+    wand = types.ModuleType('wand')
+    wand.image = types.ModuleType('wand.image')
+    wand.image.Image = Image
+    sys.modules['wand'] = wand
+    sys.modules['wand.image'] = wand.image
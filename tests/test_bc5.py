@@ -0,0 +1,128 @@
+import io
+import logging
+
+import pytest
+
+import helpers
+import tga2dds
+
+numpy = pytest.importorskip('numpy')
+
+
+class RGBImage:
+    ''' Stand-in for wand.image.Image exporting given RGB pixels '''
+
+    def __init__(self, rgb:'numpy.ndarray'):
+        self.rgb = rgb
+        self.height, self.width = rgb.shape[:2]
+        self.depth = 16
+
+    def make_blob(self, format:str) -> bytes:
+        assert format == 'RGB' and self.depth == 8
+        return self.rgb.tobytes()
+
+
+def decode_bc4(block:bytes) -> 'numpy.ndarray':
+    ''' Reference BC4 decoder, returns the 4x4 values of a block '''
+    r0, r1 = block[0], block[1]
+    if r0 > r1:
+        palette = [r0, r1] + [((7 - i) * r0 + i * r1) / 7 for i in range(1, 7)]
+    else:
+        palette = [r0, r1] + [((5 - i) * r0 + i * r1) / 5 for i in range(1, 5)] + [0, 255]
+    bits = int.from_bytes(block[2:8], 'little')
+    return numpy.array([palette[(bits >> (3 * i)) & 7] for i in range(16)]).reshape(4, 4)
+
+
+def decode_bc5(data:bytes, width:int, height:int) -> 'numpy.ndarray':
+    bw, bh = (width + 3) // 4, (height + 3) // 4
+    out = numpy.zeros((bh * 4, bw * 4, 2))
+    for i in range(bw * bh):
+        block = data[i * 16:(i + 1) * 16]
+        y, x = (i // bw) * 4, (i % bw) * 4
+        out[y:y + 4, x:x + 4, 0] = decode_bc4(block[:8])
+        out[y:y + 4, x:x + 4, 1] = decode_bc4(block[8:])
+    return out[:height, :width]
+
+
+def random_normals(width:int, height:int) -> 'numpy.ndarray':
+    rng = numpy.random.default_rng(0)
+    normals = rng.normal(size=(height, width, 3))
+    normals[..., 2] = numpy.abs(normals[..., 2]) + 1.5
+    return normals / numpy.linalg.norm(normals, axis=-1, keepdims=True)
+
+
+def write_dds(normals:'numpy.ndarray') -> bytes:
+    rgb = numpy.round((normals + 1) * 127.5).astype(numpy.uint8)
+    fdds = io.BytesIO()
+    tga2dds.write_bc5_dds(RGBImage(rgb), fdds)
+    return fdds.getvalue()
+
+
+def test_bc4_round_trip():
+    rng = numpy.random.default_rng(0)
+    # Smooth gradient plus noise, with a size which is not a multiple of 4
+    channel = numpy.clip(numpy.linspace(0, 255, 10 * 7).reshape(7, 10)
+        + rng.normal(scale=4, size=(7, 10)), 0, 255)
+    blocks = tga2dds._bc4_blocks(channel)
+    assert blocks.shape == (2 * 3, 8)
+
+    for i, block in enumerate(blocks):
+        y, x = (i // 3) * 4, (i % 3) * 4
+        expected = channel[y:y + 4, x:x + 4]
+        decoded = decode_bc4(bytes(block))[:expected.shape[0], :expected.shape[1]]
+        # Values are at most half a palette step away from the input
+        step = (expected.max() - expected.min()) / 7
+        assert numpy.abs(decoded - expected).max() <= step / 2 + 1
+
+
+def test_bc5_round_trip():
+    width, height = 13, 9
+    normals = random_normals(width, height)
+    data = write_dds(normals)
+
+    decoded = decode_bc5(data[128:], width, height)
+    expected = (tga2dds._normalize(normals.astype(numpy.float32))[..., :2] + 1) * 127.5
+    assert numpy.abs(decoded - expected).mean() < 8
+    # Reconstructed z of the decoded normals
+    xy = decoded / 127.5 - 1
+    z = numpy.sqrt(numpy.clip(1 - (xy ** 2).sum(axis=-1), 0, 1))
+    assert numpy.abs(z - normals[..., 2]).mean() < 0.1
+
+
+@pytest.mark.parametrize('width, height, nb_levels', [(5, 3, 3), (4, 4, 3), (1, 1, 1), (70, 37, 7)])
+def test_dds_header(width, height, nb_levels):
+    data = write_dds(random_normals(width, height))
+    header = tga2dds.DDS_HEADER.unpack(data[:tga2dds.DDS_HEADER.size])
+
+    assert tga2dds.DDS_HEADER.size == 128
+    assert header[0] == b'DDS '
+    assert header[1] == 124
+    assert header[3:5] == (height, width)
+    assert header[7] == nb_levels == tga2dds.mipmap_count(width, height)
+    assert header[10] == tga2dds.DDPF_FOURCC
+    assert header[11] == b'ATI2'
+
+    sizes = [((max(1, width >> i) + 3) // 4) * ((max(1, height >> i) + 3) // 4) * 16
+        for i in range(nb_levels)]
+    assert header[5] == sizes[0]
+    assert len(data) == 128 + sum(sizes)
+
+
+def test_failed_bc5_conversion_leaves_no_file(tmp_path, monkeypatch):
+    (tmp_path / 'a_n.tga').write_bytes(b'a')
+    (tmp_path / 'a_n_opt.dds').write_bytes(b'previous dds')
+    converter = tga2dds.Converter(tga2dds.Args((str(tmp_path),), normal=True),
+        working_dir=str(tmp_path), logger=logging.getLogger('tga2dds.tests'))
+    texture = converter.list_textures(str(tmp_path))[0]
+    img = RGBImage(numpy.zeros((8, 8, 3), dtype=numpy.uint8))
+
+    def compress_bc5(level):
+        raise MemoryError('out of memory')
+    monkeypatch.setattr(tga2dds, 'compress_bc5', compress_bc5)
+    assert not converter._save_on_disk(img, texture, normal=True)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a_n.tga', 'a_n_opt.dds']
+    assert (tmp_path / 'a_n_opt.dds').read_bytes() == b'previous dds'
+
+    monkeypatch.undo()
+    assert converter._save_on_disk(img, texture, normal=True)
+    assert (tmp_path / 'a_n_opt.dds').read_bytes()[:4] == b'DDS '
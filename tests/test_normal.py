@@ -0,0 +1,69 @@
+import json
+import logging
+
+import pytest
+
+import helpers
+import tga2dds
+
+# Normal mode is disabled without numpy
+pytest.importorskip('numpy')
+
+
+def make_converter(tmp_path, **kwargs) -> tga2dds.Converter:
+    args = tga2dds.Args((str(tmp_path),), normal=True, **kwargs)
+    return tga2dds.Converter(args, working_dir=str(tmp_path),
+        logger=logging.getLogger('tga2dds.tests'))
+
+
+def make_textures(tmp_path, *names:str):
+    for name in names:
+        (tmp_path / f'{name}.tga').write_bytes(b'tga')
+
+
+def is_normal_map(converter:tga2dds.Converter, tmp_path) -> dict:
+    return {t.source.basename: converter.is_normal_map(t)
+        for t in converter.list_textures(str(tmp_path))}
+
+
+def test_normal_maps_of_track_builder_project(tmp_path):
+    make_textures(tmp_path, 'grass', 'grassbump', 'dirt', 'dirtbump')
+    prj = {'TextureLayers': [
+        {'Map': 'grass.tga', 'NormalMap': {'Map': 'C:\\tracks\\Maps\\GrassBump.tga'}},
+        # Already replaced by a previous run
+        {'Map': 'dirt_opt.dds', 'NormalMap': {'Map': 'dirtbump_opt.dds'}},
+    ]}
+    (tmp_path / 'track.trk').write_text(json.dumps(prj))
+    converter = make_converter(tmp_path, trk='track.trk')
+
+    assert is_normal_map(converter, tmp_path) == {'grass': False, 'grassbump': True,
+        'dirt': False, 'dirtbump': True}
+
+
+def test_normal_maps_of_shaders(tmp_path):
+    make_textures(tmp_path, 'rock', 'rockbump', 'wall_opt')
+    (tmp_path / 'rock_opt.shd').write_text('bump\n{\n\tmap = rockbump.tga\n}\n')
+    # Generated by --shd, bump map is the texture itself
+    (tmp_path / 'wall_opt.shd').write_text(tga2dds.SHADER_CONTENT.format('wall_opt.dds'))
+    converter = make_converter(tmp_path)
+
+    assert is_normal_map(converter, tmp_path) == {'rock': False, 'rockbump': True,
+        'wall_opt': False}
+
+
+def test_normal_maps_matching_patterns(tmp_path):
+    make_textures(tmp_path, 'road', 'road_n', 'road_normal', 'road_nm2', 'tarmac_nrm')
+    assert is_normal_map(make_converter(tmp_path), tmp_path) == {'road': False,
+        'road_n': True, 'road_normal': True, 'road_nm2': False, 'tarmac_nrm': True}
+
+    converter = make_converter(tmp_path, normal_patterns=[r'_nm\d$'])
+    assert is_normal_map(converter, tmp_path) == {'road': False, 'road_n': False,
+        'road_normal': False, 'road_nm2': True, 'tarmac_nrm': False}
+
+
+def test_normal_mode_disabled(tmp_path):
+    make_textures(tmp_path, 'road_n')
+    args = tga2dds.Args((str(tmp_path),))
+    converter = tga2dds.Converter(args, working_dir=str(tmp_path),
+        logger=logging.getLogger('tga2dds.tests'))
+    assert is_normal_map(converter, tmp_path) == {'road_n': False}
@@ -0,0 +1,152 @@
+import logging
+import zipfile
+
+import pytest
+
+import helpers
+import tga2dds
+
+
+class BlobImage:
+    ''' Image converted in memory, or failing to convert if data is None '''
+
+    def __init__(self, data:bytes=None):
+        self.data = data
+
+    def make_blob(self, format:str) -> bytes:
+        if self.data is None:
+            raise RuntimeError('conversion failed')
+        return self.data
+
+
+def make_converter(tmp_path) -> tga2dds.Converter:
+    args = tga2dds.Args((str(tmp_path),), package='track.pkz')
+    return tga2dds.Converter(args, working_dir=str(tmp_path),
+        logger=logging.getLogger('tga2dds.tests'))
+
+
+def save(converter:tga2dds.Converter, texture:tga2dds.TextureInfo, img:BlobImage) -> bool:
+    with converter.open_package() as converter._package:
+        return converter._save_in_package(img, texture)
+
+
+def test_package_is_updated_incrementally(tmp_path):
+    (tmp_path / 'a.tga').write_bytes(b'a')
+    (tmp_path / 'b.tga').write_bytes(b'b')
+    converter = make_converter(tmp_path)
+    a, b = sorted(converter.list_textures(str(tmp_path)), key=lambda t: t.source.filename)
+    assert save(converter, a, BlobImage(b'dds a'))
+
+    with converter.open_package() as package:
+        encoding = converter._encoding()
+        assert package.is_up_to_date(package.entry_name(a.out.path), a.source.path, encoding)
+        assert not package.is_up_to_date(package.entry_name(b.out.path), b.source.path, encoding)
+        package.write(package.entry_name(b.out.path), b'dds b', b.source.path, encoding)
+
+    with zipfile.ZipFile(tmp_path / 'track.pkz') as zf:
+        assert sorted(zf.namelist()) == [a.out.filename, b.out.filename]
+        assert zf.read(a.out.filename) == b'dds a'
+
+
+def test_failed_conversion_is_not_indexed(tmp_path):
+    (tmp_path / 'a.tga').write_bytes(b'a')
+    converter = make_converter(tmp_path)
+    texture = converter.list_textures(str(tmp_path))[0]
+    assert not save(converter, texture, BlobImage())
+
+    with converter.open_package() as package:
+        assert not package.is_up_to_date(package.entry_name(texture.out.path),
+            texture.source.path, converter._encoding())
+    with zipfile.ZipFile(tmp_path / 'track.pkz') as zf:
+        assert zf.namelist() == []
+
+
+def test_entry_outside_package_root_is_rejected(tmp_path):
+    (tmp_path / 'track').mkdir()
+    (tmp_path / 'other').mkdir()
+    (tmp_path / 'other' / 'a.tga').write_bytes(b'a')
+    args = tga2dds.Args((str(tmp_path / 'other'),), package='track.pkz')
+    converter = tga2dds.Converter(args, working_dir=str(tmp_path / 'track'),
+        logger=logging.getLogger('tga2dds.tests'))
+    res = converter.convert()
+
+    assert res.nb_errors == 1
+    with converter.open_package() as package:
+        assert package.entry_name(str(tmp_path / 'track' / 'a.dds')) == 'a.dds'
+        with pytest.raises(ValueError):
+            package.entry_name(str(tmp_path / 'other' / 'a.dds'))
+
+
+def test_changed_encoding_is_not_up_to_date(tmp_path):
+    (tmp_path / 'a.tga').write_bytes(b'a')
+    converter = make_converter(tmp_path)
+    texture = converter.list_textures(str(tmp_path))[0]
+    assert save(converter, texture, BlobImage(b'dds a'))
+
+    with converter.open_package() as package:
+        name = package.entry_name(texture.out.path)
+        assert package.is_up_to_date(name, texture.source.path, converter._encoding())
+        assert not package.is_up_to_date(name, texture.source.path, converter._encoding(normal=True))
+        converter.args.alpha = 'off'
+        assert not package.is_up_to_date(name, texture.source.path, converter._encoding())
+        converter.args.alpha = 'auto'
+        converter.args.compression = ('dxt5', 'dxt5')
+        assert not package.is_up_to_date(name, texture.source.path, converter._encoding())
+
+
+class FakeImage(BlobImage):
+    ''' Stand-in for wand.image.Image converting any file to given data '''
+
+    size = (4, 4)
+    alpha_channel = False
+    compression = None
+
+    def __init__(self, filename:str=None):
+        super().__init__(b'dds')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def clone(self) -> 'FakeImage':
+        return self
+
+    def flip(self):
+        pass
+
+
+def test_lazy_mode_ignores_files_on_disk_in_package_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(tga2dds, 'Image', FakeImage)
+    (tmp_path / 'a.tga').write_bytes(b'a')
+    (tmp_path / 'a_opt.dds').write_bytes(b'loose dds')
+    args = tga2dds.Args((str(tmp_path),), lazy=True, package='track.pkz')
+    converter = tga2dds.Converter(args, working_dir=str(tmp_path),
+        logger=logging.getLogger('tga2dds.tests'))
+    res = converter.convert()
+
+    assert res.nb_processed == 1
+    with zipfile.ZipFile(tmp_path / 'track.pkz') as zf:
+        assert zf.read('a_opt.dds') == b'dds'
+
+
+def test_changed_shader_is_updated_in_package(tmp_path, monkeypatch):
+    monkeypatch.setattr(tga2dds, 'Image', FakeImage)
+    (tmp_path / 'a.tga').write_bytes(b'a')
+    args = tga2dds.Args((str(tmp_path),), shd=True, package='track.pkz')
+    converter = tga2dds.Converter(args, working_dir=str(tmp_path),
+        logger=logging.getLogger('tga2dds.tests'))
+    assert converter.convert().nb_processed == 1
+    with zipfile.ZipFile(tmp_path / 'track.pkz') as zf:
+        assert 'map = a_opt.dds' in zf.read('a_opt.shd').decode()
+
+    # Only the shader changed, the texture is not converted again
+    (tmp_path / 'a_opt.shd').write_text('bump\n{\n\tmap = a.tga\n}\nspecular\n{\n\tshininess = 2\n}\n')
+    res = converter.convert()
+    assert res.nb_skipped == 1
+    with zipfile.ZipFile(tmp_path / 'track.pkz') as zf:
+        shd = zf.read('a_opt.shd').decode()
+        assert 'map = a_opt.dds' in shd
+        assert 'shininess = 2' in shd
+        assert zf.read('a_opt.dds') == b'dds'
@@ -0,0 +1,171 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import pytest
+
+import helpers
+import tga2dds
+
+NB_TEXTURES = 40
+
+
+class StubConverter(tga2dds.Converter):
+    ''' Converter logging the textures it converts instead of using Wand '''
+
+    def __init__(self, args:tga2dds.Args, log_path:str):
+        super().__init__(args, logger=logging.getLogger('tga2dds.tests'))
+        self.log_path = log_path
+
+    def convert_texture(self, texture:tga2dds.TextureInfo, res:tga2dds.Results) -> str:
+        with open(self.log_path, 'a') as flog:
+            flog.write(texture.source.path + '\n')
+        return res.add(tga2dds.PROCESSED, texture, 10, 1)
+
+
+def run_worker(folder:str, queue_path:str, worker_id:str, log_path:str):
+    converter = StubConverter(tga2dds.Args((folder,)), log_path)
+    queue = tga2dds.WorkQueue(queue_path, worker_id=worker_id)
+    converter.enqueue(queue)
+    converter.convert_queue(queue, poll=0.05)
+
+
+def make_textures(tmp_path) -> str:
+    folder = tmp_path / 'textures'
+    folder.mkdir()
+    for i in range(NB_TEXTURES):
+        (folder / f'texture{i}.tga').write_bytes(b'')
+    return str(folder)
+
+
+def read_logs(tmp_path):
+    converted = []
+    for log in tmp_path.glob('*.log'):
+        converted += log.read_text().splitlines()
+    return converted
+
+
+def read_report(queue_path:str) -> dict:
+    with open(os.path.join(queue_path, tga2dds.WorkQueue.REPORT), 'r') as freport:
+        return json.load(freport)
+
+
+def test_jobs_claimed_once_by_several_processes(tmp_path):
+    folder = make_textures(tmp_path)
+    queue_path = str(tmp_path / 'queue')
+    ctx = multiprocessing.get_context('spawn')
+    workers = [ctx.Process(target=run_worker, args=(
+            folder, queue_path, f'worker{i}', str(tmp_path / f'worker{i}.log')))
+        for i in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(60)
+        assert w.exitcode == 0
+
+    converted = read_logs(tmp_path)
+    assert len(converted) == NB_TEXTURES
+    assert len(set(converted)) == NB_TEXTURES
+    assert len(os.listdir(os.path.join(queue_path, tga2dds.WorkQueue.DONE))) == NB_TEXTURES
+    report = read_report(queue_path)
+    assert report['nb_processed'] == NB_TEXTURES
+    assert report['total_source_size'] == NB_TEXTURES * 10
+
+
+def test_put_is_idempotent(tmp_path):
+    folder = make_textures(tmp_path)
+    queue = tga2dds.WorkQueue(str(tmp_path / 'queue'))
+    converter = StubConverter(tga2dds.Args((folder,)), str(tmp_path / 'worker.log'))
+    assert converter.enqueue(queue) == NB_TEXTURES
+    assert converter.enqueue(queue) == 0
+    converter.convert_queue(queue, poll=0)
+    assert converter.enqueue(queue) == 0
+    assert len(read_logs(tmp_path)) == NB_TEXTURES
+
+
+def test_expired_lease_is_recovered(tmp_path):
+    folder = make_textures(tmp_path)
+    queue_path = str(tmp_path / 'queue')
+    dead = tga2dds.WorkQueue(queue_path, worker_id='dead', lease=60)
+    converter = StubConverter(tga2dds.Args((folder,)), str(tmp_path / 'worker.log'))
+    converter.enqueue(dead)
+
+    # The dead worker has claimed a job and written its record long ago
+    claimed, job = dead.claim()
+    texture = tga2dds.TextureInfo(source=tga2dds.PathInfo(job['source']), output_suffix='_opt')
+    with dead.open_results() as fresults:
+        tga2dds.Results(keep_textures=False, report=fresults).add(
+            tga2dds.PROCESSED, texture, 10, 1)
+    expired = time.time() - 120
+    os.utime(claimed, (expired, expired))
+
+    queue = tga2dds.WorkQueue(queue_path, worker_id='alive', lease=60)
+    assert queue.recover() == 1
+    assert queue.recover() == 0
+    res = converter.convert_queue(queue, poll=0)
+    assert not dead.complete(claimed)
+
+    assert len(read_logs(tmp_path)) == NB_TEXTURES
+    assert res.nb_processed == NB_TEXTURES
+    assert res.total_source_size == NB_TEXTURES * 10
+    assert read_report(queue_path)['nb_processed'] == NB_TEXTURES
+    # Report is only written by the first worker seeing the queue drained
+    assert not queue.write_report(res)
+
+
+def test_package_is_rejected_before_enqueuing(tmp_path, monkeypatch, capsys):
+    folder = make_textures(tmp_path)
+    queue_path = str(tmp_path / 'queue')
+    monkeypatch.setattr(sys, 'argv', ['tga2dds.py', '--queue', queue_path,
+        '--package', 'track.pkz', folder])
+    with pytest.raises(SystemExit):
+        tga2dds.command_line(logging.getLogger('tga2dds.tests'))
+    assert '--package is not supported with --queue' in capsys.readouterr().err
+
+    queue = tga2dds.WorkQueue(queue_path)
+    args = tga2dds.Args((folder,), package='track.pkz')
+    with pytest.raises(ValueError):
+        StubConverter(args, str(tmp_path / 'worker.log')).enqueue(queue)
+    assert os.listdir(os.path.join(queue_path, tga2dds.WorkQueue.PENDING)) == []
+
+
+def test_report_is_written_in_queue_mode(tmp_path):
+    folder = make_textures(tmp_path)
+    queue = tga2dds.WorkQueue(str(tmp_path / 'queue'))
+    args = tga2dds.Args((folder,), report=str(tmp_path / 'report.jsonl'))
+    converter = StubConverter(args, str(tmp_path / 'worker.log'))
+    converter.enqueue(queue)
+    res = converter.convert_queue(queue, poll=0)
+
+    assert res.nb_processed == NB_TEXTURES
+    assert res.processed == []
+    with open(tmp_path / 'report.jsonl', 'r') as freport:
+        records = [json.loads(line) for line in freport]
+    assert len(records) == NB_TEXTURES
+    assert set([r['status'] for r in records]) == set([tga2dds.PROCESSED])
+
+
+def test_job_never_made_pending_is_recovered(tmp_path):
+    folder = make_textures(tmp_path)
+    queue_path = str(tmp_path / 'queue')
+    queue = tga2dds.WorkQueue(queue_path, worker_id='alive', lease=60)
+    converter = StubConverter(tga2dds.Args((folder,)), str(tmp_path / 'worker.log'))
+    converter.enqueue(queue)
+
+    # The worker registering the job died before making it pending
+    job_id = tga2dds.WorkQueue.job_id(os.path.join(folder, 'texture0.tga'))
+    os.remove(os.path.join(queue_path, tga2dds.WorkQueue.PENDING, f'{job_id}.json'))
+    job = os.path.join(queue_path, tga2dds.WorkQueue.JOBS, f'{job_id}.json')
+    assert converter.enqueue(queue) == 0
+    assert queue.recover() == 0
+    expired = time.time() - 120
+    os.utime(job, (expired, expired))
+
+    res = converter.convert_queue(queue, poll=0)
+    assert queue.drained
+    assert res.nb_processed == NB_TEXTURES
+    assert sorted(read_logs(tmp_path)) == sorted(set(read_logs(tmp_path)))
+    assert len(read_logs(tmp_path)) == NB_TEXTURES
@@ -0,0 +1,47 @@
+import io
+import json
+
+import helpers
+import tga2dds
+
+
+def make_results(keep_textures:bool=True, report=None) -> tga2dds.Results:
+    res = tga2dds.Results(keep_textures=keep_textures, report=report)
+    texture = tga2dds.TextureInfo(source=tga2dds.PathInfo('a.tga'), output_suffix='_opt')
+    res.add(tga2dds.PROCESSED, texture, 10, 1)
+    res.add(tga2dds.WITH_ERRORS, texture)
+    return res
+
+
+def test_streamed_results_keep_only_counters():
+    report = io.StringIO()
+    res = make_results(keep_textures=False, report=report)
+    res += make_results()
+
+    assert res.nb_processed == 2
+    assert res.nb_errors == 2
+    assert res.total_source_size == 20
+    assert res.processed == [] and res.with_errors == []
+    records = [json.loads(line) for line in report.getvalue().splitlines()]
+    assert [r['status'] for r in records] == [tga2dds.PROCESSED, tga2dds.WITH_ERRORS]
+
+
+def test_adding_streamed_results_drops_textures():
+    res = make_results()
+    res += make_results(keep_textures=False)
+
+    assert not res.keep_textures
+    assert res.nb_processed == 2
+    assert res.processed == [] and res.with_errors == []
+
+
+def test_merge():
+    res = tga2dds.Results.merge([make_results(), make_results()])
+    assert res.keep_textures
+    assert res.nb_processed == 2
+    assert len(res.processed) == 2
+
+    res = tga2dds.Results.merge([make_results(), make_results(keep_textures=False)])
+    assert not res.keep_textures
+    assert res.nb_processed == 2
+    assert res.processed == []
@@ -1,22 +1,36 @@
 
+import contextlib
 import dataclasses
 from distutils import extension
+import hashlib
+import io
 import json
 import ntpath
 from posixpath import isabs
-from typing import List, Optional, Sequence, Tuple
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
 from wand.image import Image
+try:
+    import numpy
+except ImportError:
+    # Only required for normal maps compression
+    numpy = None
 import os
 import re
+import socket
+import struct
 import sys
 import argparse
 import logging
 import time
+import zipfile
 from datetime import datetime
 
 DEFAULT_COMPRESSION = ('dxt1', 'dxt3')
+NORMAL_COMPRESSION = 'bc5'
+DEFAULT_NORMAL_PATTERNS = (r'_(n|nm|nrm|norm|normal)$',)
 
-RE_REPLACE_SHD_FN = re.compile(r'\bmap\b\s*=\s*([\w\s\.]+)\s*$')
+RE_REPLACE_SHD_FN = re.compile(r'\bmap\b[ \t]*=[ \t]*([\w \t\.]+?)[ \t]*$', re.MULTILINE)
+RE_SHD_BUMP_MAP = re.compile(r'\bbump\s*\{[^}]*?\bmap\b[ \t]*=[ \t]*([^\r\n}]+?)[ \t]*$', re.MULTILINE)
 SHADER_CONTENT = '''bump
 {{
 	map = {}
@@ -37,7 +51,11 @@ class Args:
             compression:Sequence[str]=DEFAULT_COMPRESSION, lazy:bool=False,
             shd:bool=False, trk:Optional[str]=None, suffix:Optional[str]=None,
             filters:Optional[Sequence[str]]=None, excludes:Optional[Sequence[str]]=None,
-            ext_src='tga', ext_out='dds', verbose:Optional[bool]=None):
+            ext_src='tga', ext_out='dds', verbose:Optional[bool]=None,
+            queue:Optional[str]=None, worker_id:Optional[str]=None, lease:float=600,
+            package:Optional[str]=None, package_compression:str='auto',
+            package_root:Optional[str]=None, report:Optional[str]=None,
+            normal:bool=False, normal_patterns:Optional[Sequence[str]]=None):
         self.paths:List[str] = paths
         self.alpha:str = alpha
         self.compression:Sequence[str] = compression
@@ -52,19 +70,33 @@ class Args:
         self.ext_src = ext_src
         self.ext_out = ext_out
         self.verbose = verbose or False
+        self.queue:str = queue or ''
+        self.worker_id:Optional[str] = worker_id
+        self.lease:float = lease
+        self.package:str = package or ''
+        self.package_compression:str = package_compression
+        self.package_root:str = package_root or ''
+        self.report:str = report or ''
+        self.normal:bool = normal
+        self.normal_patterns:Sequence[re.Pattern] = tuple(
+            [re.compile(f, re.IGNORECASE) for f in normal_patterns or DEFAULT_NORMAL_PATTERNS])
 
     @classmethod
     def from_namespace(cls, args:argparse.Namespace) -> 'Args':
         ''' Init Tga2DdsArgs from argparse.Namespace '''
-        compression = args.compression.split(' ')
+        compression = ' '.join(args.compression or []).split()
         if len(compression) < 2:
             compression = DEFAULT_COMPRESSION
 
         return Args(
             paths=args.path, alpha=args.alpha, compression=compression,
-            lazy=args.lazy, shd=args.shd, tkr=args.trk, suffix=args.suffix,
+            lazy=args.lazy, shd=args.shd, trk=args.trk, suffix=args.suffix,
             filters=args.filter, excludes=args.exclude, ext_src=args.ext_src,
-            ext_out=args.ext_out, verbose=args.verbose
+            ext_out=args.ext_out, verbose=args.verbose, queue=args.queue,
+            worker_id=args.worker_id, lease=args.lease, package=args.package,
+            package_compression=args.package_compression,
+            package_root=args.package_root, report=args.report,
+            normal=args.normal, normal_patterns=args.normal_pattern
         )
 
 @dataclasses.dataclass
@@ -119,6 +151,43 @@ class TextureInfo:
         extension expected by args.ext_src '''
         return self.ext_src == f'.{os.path.splitext(self.source.filename)[1]}'
 
+PROCESSED = 'processed'
+SKIPPED = 'skipped'
+WITH_ERRORS = 'with_errors'
+STATUSES = (PROCESSED, SKIPPED, WITH_ERRORS)
+
+class TextureRecord:
+    ''' Compact record of the conversion result of a texture, as written in
+    results reports '''
+    __slots__ = ('status', 'source', 'output_suffix', 'ext_out',
+        'source_size', 'out_size')
+
+    def __init__(self, status:str, source:str, output_suffix:str='',
+            ext_out:str='.dds', source_size:int=0, out_size:int=0):
+        self.status = status
+        self.source = source
+        self.output_suffix = output_suffix
+        self.ext_out = ext_out
+        self.source_size = source_size
+        self.out_size = out_size
+
+    @classmethod
+    def from_texture(cls, status:str, texture:TextureInfo, source_size:int=0,
+            out_size:int=0) -> 'TextureRecord':
+        return TextureRecord(status, texture.source.path, texture.output_suffix,
+            texture.ext_out, source_size, out_size)
+
+    @classmethod
+    def from_dict(cls, data:dict) -> 'TextureRecord':
+        return TextureRecord(**data)
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def to_texture(self) -> TextureInfo:
+        return TextureInfo(source=PathInfo(self.source), ext_out=self.ext_out,
+            output_suffix=self.output_suffix)
+
 # Class for output results
 @dataclasses.dataclass
 class Results:
@@ -127,26 +196,63 @@ class Results:
     processed:List[TextureInfo]=dataclasses.field(default_factory=list)
     skipped:List[TextureInfo]=dataclasses.field(default_factory=list)
     with_errors:List[TextureInfo]=dataclasses.field(default_factory=list)
+    # Number of textures by status
+    counts:Dict[str, int]=dataclasses.field(
+        default_factory=lambda: dict.fromkeys(STATUSES, 0))
+    # Keep TextureInfo of every texture in processed, skipped and with_errors
+    # lists. Only counts and sizes are kept otherwise
+    keep_textures:bool = True
+    # Stream where a json line is written for each texture added
+    report:Optional[IO[str]]=dataclasses.field(default=None, repr=False, compare=False)
+
+    def add(self, status:str, texture:TextureInfo, source_size:int=0, out_size:int=0) -> str:
+        ''' Add the result of a texture conversion, return its status '''
+        self.counts[status] += 1
+        self.total_source_size += source_size
+        self.total_out_size += out_size
+        if self.keep_textures:
+            getattr(self, status).append(texture)
+        if self.report is not None:
+            record = TextureRecord.from_texture(status, texture, source_size, out_size)
+            self.report.write(json.dumps(record.to_dict()) + '\n')
+            self.report.flush()
+        return status
 
     def __iadd__(self, other:'Results'):
         self.total_source_size += other.total_source_size
         self.total_out_size += other.total_out_size
-        self.processed += other.processed
-        self.skipped += other.skipped
-        self.with_errors += other.with_errors
+        for status in STATUSES:
+            self.counts[status] += other.counts[status]
+        if self.keep_textures and not other.keep_textures:
+            # Textures of other are unknown, lists would not match the counts
+            self.keep_textures = False
+            self.processed, self.skipped, self.with_errors = [], [], []
+        elif self.keep_textures:
+            self.processed += other.processed
+            self.skipped += other.skipped
+            self.with_errors += other.with_errors
+        return self
 
     @staticmethod
     def merge(results:Sequence['Results']) -> 'Results':
         ''' Merge results data together '''
-        new_res = Results()
+        new_res = Results(keep_textures=all([r.keep_textures for r in results]))
         for r in results:
-            new_res.total_source_size += r.total_source_size
-            new_res.total_out_size += r.total_out_size
-            new_res.processed += r.processed
-            new_res.skipped += r.skipped
-            new_res.with_errors += r.with_errors
+            new_res += r
         return new_res
 
+    @staticmethod
+    def from_records(records:Iterable[TextureRecord], keep_textures:bool=True) -> 'Results':
+        ''' Results from texture records read from a report '''
+        res = Results(keep_textures=keep_textures)
+        for r in records:
+            res.counts[r.status] += 1
+            res.total_source_size += r.source_size
+            res.total_out_size += r.out_size
+            if keep_textures:
+                getattr(res, r.status).append(r.to_texture())
+        return res
+
     @property
     def saved(self) -> int:
         return self.total_source_size - self.total_out_size
@@ -157,15 +263,15 @@ class Results:
 
     @property
     def nb_processed(self) -> int:
-        return len(self.processed)
+        return self.counts[PROCESSED]
 
     @property
     def nb_skipped(self) -> int:
-        return len(self.skipped)
+        return self.counts[SKIPPED]
 
     @property
     def nb_errors(self) -> int:
-        return len(self.with_errors)
+        return self.counts[WITH_ERRORS]
 
     @property
     def total_source_size_string(self) -> str:
@@ -176,6 +282,293 @@ class Results:
         return file_size_to_string(self.total_out_size)
 
 
+class WorkQueue:
+    ''' Queue of texture jobs stored in a shared directory, so several
+    tga2dds processes, possibly running on different hosts, can convert the
+    textures of the same folders together.
+
+    Each job is registered once as a json file of the "jobs" sub-folder, then
+    its state is an empty file moved between the "pending", "claimed" and
+    "done" sub-folders with atomic renames. A claimed job is leased to its worker for
+    `lease` seconds, after what it is moved back to "pending" so that jobs of
+    dead workers are recovered by the others. Jobs registered by a worker which
+    died before making them pending are also recovered once their lease has
+    expired. Each worker streams its results
+    to its own json lines file of the "results" sub-folder '''
+
+    JOBS = 'jobs'
+    PENDING = 'pending'
+    CLAIMED = 'claimed'
+    DONE = 'done'
+    RESULTS = 'results'
+    REPORT = 'report.json'
+
+    def __init__(self, path:str, worker_id:Optional[str]=None, lease:float=600):
+        self.path = os.path.realpath(path)
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease = lease
+        for d in (self.JOBS, self.PENDING, self.CLAIMED, self.DONE, self.RESULTS):
+            os.makedirs(os.path.join(self.path, d), exist_ok=True)
+
+    def _path(self, *names:str) -> str:
+        return os.path.join(self.path, *names)
+
+    @staticmethod
+    def job_id(path:str) -> str:
+        ''' Unique id of the job converting given source file '''
+        return hashlib.sha1(os.path.realpath(path).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _job_id_from_filename(filename:str) -> str:
+        # Claimed jobs are named "<job_id>.<worker_id>.json"
+        return filename.split('.', 1)[0]
+
+    def put(self, paths:Sequence[str]) -> int:
+        ''' Add jobs for given source files, unless they are already known by
+        the queue. Return the number of jobs added '''
+        nb_added = 0
+        for path in paths:
+            job_id = self.job_id(path)
+            job = self._path(self.JOBS, f'{job_id}.json')
+            if os.path.exists(job):
+                continue
+            tmp = self._path(self.JOBS, f'{job_id}.{self.worker_id}.tmp')
+            with open(tmp, 'w') as fjob:
+                json.dump({'source': os.path.realpath(path)}, fjob)
+            try:
+                # Only one worker can register a job, whatever its current
+                # state, and the job is registered completely written
+                os.link(tmp, job)
+            except FileExistsError:
+                continue
+            finally:
+                os.remove(tmp)
+            open(self._path(self.PENDING, f'{job_id}.json'), 'w').close()
+            nb_added += 1
+        return nb_added
+
+    def claim(self) -> Optional[Tuple[str, dict]]:
+        ''' Claim the next pending job. Return the path of the claimed job file
+        and the job content, or None if there is no pending job '''
+        for filename in sorted(os.listdir(self._path(self.PENDING))):
+            job_id = self._job_id_from_filename(filename)
+            pending = self._path(self.PENDING, filename)
+            claimed = self._path(self.CLAIMED, f'{job_id}.{self.worker_id}.json')
+            try:
+                # Refresh the lease before the job becomes visible as claimed
+                os.utime(pending)
+                os.rename(pending, claimed)
+            except OSError:
+                # Claimed by another worker in the meantime
+                continue
+            with open(self._path(self.JOBS, f'{job_id}.json'), 'r') as fjob:
+                return claimed, json.load(fjob)
+        return None
+
+    def complete(self, claimed:str) -> bool:
+        ''' Mark a claimed job as done. Return False if the lease of the job
+        has expired and the job has been recovered by another worker '''
+        job_id = self._job_id_from_filename(os.path.basename(claimed))
+        try:
+            os.rename(claimed, self._path(self.DONE, f'{job_id}.json'))
+        except OSError:
+            return False
+        return True
+
+    def _job_ids(self, state:str) -> Set[str]:
+        return set([self._job_id_from_filename(f) for f in os.listdir(self._path(state))
+            if f.endswith('.json')])
+
+    def recover(self) -> int:
+        ''' Move back to pending the claimed jobs which lease has expired, and
+        make pending the registered jobs which never were. Return the number of
+        jobs recovered '''
+        nb_recovered = 0
+        now = time.time()
+        for filename in os.listdir(self._path(self.CLAIMED)):
+            claimed = self._path(self.CLAIMED, filename)
+            job_id = self._job_id_from_filename(filename)
+            try:
+                if now - os.path.getmtime(claimed) < self.lease:
+                    continue
+                os.rename(claimed, self._path(self.PENDING, f'{job_id}.json'))
+            except OSError:
+                # Completed or recovered by another worker in the meantime
+                continue
+            nb_recovered += 1
+
+        known = (self._job_ids(self.PENDING) | self._job_ids(self.CLAIMED)
+            | self._job_ids(self.DONE))
+        for job_id in self._job_ids(self.JOBS) - known:
+            try:
+                # Registered by a worker which died before making it pending
+                if now - os.path.getmtime(self._path(self.JOBS, f'{job_id}.json')) < self.lease:
+                    continue
+                fd = os.open(self._path(self.PENDING, f'{job_id}.json'),
+                    os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+            except OSError:
+                continue
+            nb_recovered += 1
+        return nb_recovered
+
+    @property
+    def drained(self) -> bool:
+        ''' Indicates if all the jobs of the queue are done '''
+        return (len(os.listdir(self._path(self.PENDING))) == 0
+            and len(os.listdir(self._path(self.CLAIMED))) == 0
+            and len(self._job_ids(self.JOBS)) == len(self._job_ids(self.DONE)))
+
+    def open_results(self) -> IO[str]:
+        ''' Open the results file of the worker, for Results.report '''
+        return open(self._path(self.RESULTS, f'{self.worker_id}.jsonl'), 'a')
+
+    def records(self) -> Iterator[TextureRecord]:
+        ''' Texture records of all the workers, one by source file. The last
+        record read wins if a source has been converted several times '''
+        records:Dict[str, TextureRecord] = {}
+        for filename in sorted(os.listdir(self._path(self.RESULTS))):
+            with open(self._path(self.RESULTS, filename), 'r') as fres:
+                for line in fres:
+                    if len(line.strip()) > 0:
+                        r = TextureRecord.from_dict(json.loads(line))
+                        records[r.source] = r
+        return iter(records.values())
+
+    def results(self, keep_textures:bool=True) -> Results:
+        ''' Results of all the workers merged together '''
+        return Results.from_records(self.records(), keep_textures=keep_textures)
+
+    def write_report(self, res:Results) -> bool:
+        ''' Write the merged report of the queue. Only the first worker to call
+        it writes the report, return False for the others '''
+        try:
+            fd = os.open(self._path(self.REPORT), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as freport:
+            report = {
+                'total_source_size': res.total_source_size,
+                'total_out_size': res.total_out_size,
+            }
+            for status in STATUSES:
+                report[f'nb_{status}'] = res.counts[status]
+                if res.keep_textures:
+                    report[status] = [t.source.path for t in getattr(res, status)]
+            json.dump(report, freport, indent=2)
+        return True
+
+class Package:
+    ''' Zip package (pkz for MxBikes) where output files are written directly
+    instead of being written next to the source files.
+
+    The package is written in a temporary file replacing the package once
+    closed. An index of the source file and encoding settings of each entry is
+    kept next to the package, in "<package>.index.json", so an existing package
+    is updated incrementally: entries which source and encoding have not
+    changed are copied from the previous package instead of being converted
+    again '''
+
+    COMPRESSION = {'store': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED}
+
+    def __init__(self, path:str, root:str, compression:str='auto'):
+        self.path = os.path.realpath(path)
+        self.root = os.path.realpath(root)
+        self.compression = compression
+        self._previous_index:dict = {}
+        self._index:dict = {}
+        self._zip:Optional[zipfile.ZipFile] = None
+
+    @property
+    def index_path(self) -> str:
+        return f'{self.path}.index.json'
+
+    @property
+    def tmp_path(self) -> str:
+        return f'{self.path}.tmp'
+
+    def __enter__(self) -> 'Package':
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+    def open(self) -> 'Package':
+        ''' Load index of the existing package and start writing the new one '''
+        if os.path.exists(self.path) and os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as findex:
+                self._previous_index = json.load(findex)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._zip = zipfile.ZipFile(self.tmp_path, 'w')
+        return self
+
+    def close(self, commit:bool=True):
+        ''' Copy unchanged entries of the previous package and replace it with
+        the new one. The new package is discarded if commit is False '''
+        self._zip.close()
+        if not commit:
+            os.remove(self.tmp_path)
+            return
+        with zipfile.ZipFile(self.tmp_path, 'a') as new_zip:
+            if os.path.exists(self.path):
+                with zipfile.ZipFile(self.path, 'r') as old_zip:
+                    for info in old_zip.infolist():
+                        if info.filename in self._index:
+                            continue
+                        new_zip.writestr(info, old_zip.read(info))
+                        if info.filename in self._previous_index:
+                            self._index[info.filename] = self._previous_index[info.filename]
+        os.replace(self.tmp_path, self.path)
+        with open(self.index_path, 'w') as findex:
+            json.dump(self._index, findex, indent=2)
+
+    def entry_name(self, path:str) -> str:
+        ''' Name of the entry for given file path, relative to package root.
+        Raise ValueError if the file is not under the package root '''
+        try:
+            name = os.path.relpath(os.path.realpath(path), self.root).replace(os.sep, '/')
+        except ValueError:
+            # Path on another drive
+            name = '..'
+        if name == '..' or name.startswith('../'):
+            raise ValueError(f'{path} is outside package root {self.root}')
+        return name
+
+    def _compress_type(self, name:str) -> int:
+        if self.compression == 'auto':
+            # DDS are already compressed, deflating them costs more than it saves
+            return zipfile.ZIP_STORED if name.lower().endswith('.dds') else zipfile.ZIP_DEFLATED
+        return self.COMPRESSION[self.compression]
+
+    @staticmethod
+    def _source_stamp(source:str, encoding:Optional[dict]=None) -> dict:
+        stat = os.stat(source)
+        stamp = {'source': os.path.realpath(source), 'mtime': stat.st_mtime_ns,
+            'size': stat.st_size}
+        if encoding is not None:
+            stamp['encoding'] = encoding
+        return stamp
+
+    def is_up_to_date(self, name:str, source:str, encoding:Optional[dict]=None) -> bool:
+        ''' Indicates if the entry is in the previous package, and neither its
+        source nor the encoding settings it was written with have changed since '''
+        previous = self._previous_index.get(name)
+        return previous is not None and previous == self._source_stamp(source, encoding)
+
+    def write(self, name:str, data:Union[str, bytes], source:str,
+            encoding:Optional[dict]=None):
+        ''' Write an entry of the package. The entry is indexed as up to date
+        only once it has been written successfully '''
+        info = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+        info.compress_type = self._compress_type(name)
+        self._index.pop(name, None)
+        self._zip.writestr(info, data.encode('utf-8') if isinstance(data, str) else data)
+        self._index[name] = self._source_stamp(source, encoding)
+
+    def size(self, name:str) -> int:
+        ''' Size of a written entry in the package '''
+        return self._zip.getinfo(name).compress_size
+
 
 
 # def create_logger() -> logging.Logger:
@@ -223,7 +616,8 @@ def command_line(logger:logging.Logger) -> Args:
         provided as two values in the same order. Default are dxt1 (Non-alpha)
         and dxt3 (Alpha). Example: -c dxt1 dxt3''')
     parser.add_argument('-l','--lazy', action='store_true',
-        help='Lazy mode, does not create dds file if it already exists')
+        help='''Lazy mode, does not create dds file if it already exists. Ignored
+        with --package, where only textures whose source has changed are converted''')
     parser.add_argument('--shd', action='store_true',
         help='''Replace <file_name>.tga by <output_file_name>.dds in corresponding shd file, if found.
     Create automatically a new shd file in case dds filename is different than tga's one''')
@@ -246,9 +640,46 @@ def command_line(logger:logging.Logger) -> Args:
         format supported by Wand''')
     parser.add_argument('-v','--verbose', action='store_true',
         help='Enable verbose mode')
+    parser.add_argument('--queue', nargs='?', const='', default='',
+        help='''Shared directory used as work queue. Textures found are added
+        to the queue then converted by all the tga2dds processes using the same
+        queue, possibly from different hosts''')
+    parser.add_argument('--worker-id',
+        help='''Worker name in queue mode. Must be unique among the workers,
+        "<hostname>-<pid>" by default''')
+    parser.add_argument('--lease', type=float, default=600,
+        help='''Time in seconds after what a job claimed by a worker is given
+        back to the queue in queue mode. Must be longer than the conversion of
+        a single texture. 600 by default''')
+    parser.add_argument('--package', nargs='?', const='', default='',
+        help='''Write output files, and shd files with --shd, in given zip
+        package (pkz for MxBikes) instead of next to the source files. Only the
+        entries whose source has changed are converted again if the package
+        exists, though the whole package is rewritten''')
+    parser.add_argument('--package-compression', choices=['store', 'deflate', 'auto'],
+        default='auto', help='''Compression of the package entries. auto ->
+        dds files are stored, other files are deflated. auto by default''')
+    parser.add_argument('--package-root', nargs='?', const='', default='',
+        help='''Folder the package entries are relative to. Working directory
+        by default''')
+    parser.add_argument('-n', '--normal', action='store_true',
+        help='''Compress normal maps in BC5 (ATI2) instead of dxt1/dxt3. Normal
+        maps are detected from NormalMap in trk file, bump map in shd files
+        and file names matching normal patterns. Requires numpy''')
+    parser.add_argument('--normal-pattern', action='append',
+        help='''Process files matching given patterns as normal maps in normal
+        mode. Used as regular expression on the file name without extension.
+        Default is "_(n|nm|nrm|norm|normal)$"''')
+    parser.add_argument('--report', nargs='?', const='', default='',
+        help='''Write the result of each texture in given json lines file as
+        soon as it is converted. Only counts and sizes are kept in memory. With
+        --queue, written with the results of all the workers once the queue is
+        drained''')
 
     args = parser.parse_args()
     logger.debug(json.dumps(vars(args), indent=2))
+    if len(args.queue) > 0 and len(args.package) > 0:
+        parser.error('--package is not supported with --queue')
     return Args.from_namespace(args)
 
 
@@ -270,6 +701,95 @@ def get_file_size(path):
     ''' Get file size '''
     return file_size_to_string(os.path.getsize(path))
 
+# Number of 4x4 blocks compressed at once, bounds the size of the distances
+# between pixels and palette entries computed for each block
+BC_CHUNK_SIZE = 16384
+# Weights of the two end points for the eight BC4 palette entries, in index order
+BC4_WEIGHTS = ((7, 0), (0, 7), (6, 1), (5, 2), (4, 3), (3, 4), (2, 5), (1, 6))
+
+DDS_HEADER = struct.Struct('<4s7I44s2I4s5I5I')
+DDSD_FLAGS = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000 # caps, height, width, pixel format, linear size
+DDSD_MIPMAPCOUNT = 0x20000
+DDPF_FOURCC = 0x4
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x8 | 0x400000 # complex, mipmap
+
+def _normalize(normals:'numpy.ndarray') -> 'numpy.ndarray':
+    ''' Normalize an array of vectors, null vectors are replaced by (0, 0, 1) '''
+    length = numpy.sqrt((normals ** 2).sum(axis=-1, keepdims=True))
+    normals = numpy.divide(normals, length, out=numpy.zeros_like(normals), where=length > 0)
+    normals[..., 2][length[..., 0] == 0] = 1
+    return normals
+
+def mipmap_count(width:int, height:int) -> int:
+    ''' Number of mipmap levels down to 1x1 '''
+    return max(width, height).bit_length()
+
+def _normal_mipmaps(normals:'numpy.ndarray') -> Iterator['numpy.ndarray']:
+    ''' Mipmaps of a normal map down to 1x1, each level averages the normals of
+    the previous one then renormalizes them. Levels are generated one by one,
+    so only two levels are in memory at once '''
+    yield normals
+    while normals.shape[0] > 1 or normals.shape[1] > 1:
+        fh = 2 if normals.shape[0] > 1 else 1
+        fw = 2 if normals.shape[1] > 1 else 1
+        h, w = normals.shape[0] // fh, normals.shape[1] // fw
+        normals = normals[:h * fh, :w * fw].reshape(h, fh, w, fw, 3).mean(axis=(1, 3))
+        normals = _normalize(normals)
+        yield normals
+
+def _bc4_blocks(channel:'numpy.ndarray') -> 'numpy.ndarray':
+    ''' Compress a channel of values in [0, 255] to BC4 blocks. Return an array
+    of shape (nb_blocks, 8) of blocks in row order '''
+    h, w = channel.shape
+    # Pad with the edge values up to whole blocks
+    channel = numpy.pad(channel, ((0, -h % 4), (0, -w % 4)), mode='edge')
+    bh, bw = channel.shape[0] // 4, channel.shape[1] // 4
+    blocks = channel.reshape(bh, 4, bw, 4).transpose(0, 2, 1, 3).reshape(-1, 16)
+
+    weights = numpy.array(BC4_WEIGHTS, dtype=numpy.float32) / 7
+    shifts = numpy.arange(16, dtype=numpy.uint64) * numpy.uint64(3)
+    byte_shifts = numpy.arange(6, dtype=numpy.uint64) * numpy.uint64(8)
+    out = numpy.empty((blocks.shape[0], 8), dtype=numpy.uint8)
+    for start in range(0, blocks.shape[0], BC_CHUNK_SIZE):
+        b = blocks[start:start + BC_CHUNK_SIZE]
+        # max and min as end points select the 8 values palette mode
+        e0 = numpy.round(b.max(axis=1))
+        e1 = numpy.round(b.min(axis=1))
+        palette = e0[:, None] * weights[:, 0] + e1[:, None] * weights[:, 1]
+        indices = numpy.abs(b[:, :, None] - palette[:, None, :]).argmin(axis=2)
+        bits = (indices.astype(numpy.uint64) << shifts).sum(axis=1, dtype=numpy.uint64)
+        out[start:start + BC_CHUNK_SIZE, 0] = e0
+        out[start:start + BC_CHUNK_SIZE, 1] = e1
+        out[start:start + BC_CHUNK_SIZE, 2:] = (bits[:, None] >> byte_shifts) & numpy.uint64(0xFF)
+    return out
+
+def compress_bc5(normals:'numpy.ndarray') -> bytes:
+    ''' Compress x and y of unit normals to BC5 blocks, z is dropped as it is
+    reconstructed from x and y '''
+    xy = (normals[..., :2] + 1) * 127.5
+    return numpy.concatenate(
+        [_bc4_blocks(xy[..., 0]), _bc4_blocks(xy[..., 1])], axis=1).tobytes()
+
+def write_bc5_dds(img:Image, fout:IO[bytes]):
+    ''' Write image as a normal map compressed in BC5 (ATI2) DDS file, with
+    renormalized mipmaps. Requires numpy '''
+    width, height = img.width, img.height
+    linear_size = ((width + 3) // 4) * ((height + 3) // 4) * 16
+    fout.write(DDS_HEADER.pack(
+        b'DDS ', 124, DDSD_FLAGS | DDSD_MIPMAPCOUNT, height, width, linear_size,
+        0, mipmap_count(width, height), bytes(44),
+        32, DDPF_FOURCC, b'ATI2', 0, 0, 0, 0, 0,
+        DDSCAPS_TEXTURE | DDSCAPS_MIPMAP, 0, 0, 0, 0))
+
+    img.depth = 8
+    rgb = numpy.frombuffer(img.make_blob(format='RGB'), dtype=numpy.uint8)
+    normals = _normalize(rgb.reshape(height, width, 3).astype(numpy.float32) / 127.5 - 1)
+    del rgb
+    # Each level is compressed and written before the next one is generated
+    for level in _normal_mipmaps(normals):
+        fout.write(compress_bc5(level))
+
 class Converter:
 
     def __init__(self, args:Args, working_dir:Optional[str]=None,
@@ -278,6 +798,15 @@ class Converter:
         self.logger = logger or create_logger(args.verbose)
         self.working_dir = working_dir or os.getcwd()
         self.args = args
+        # Package where output files are written, while converting in package mode
+        self._package:Optional[Package] = None
+        # Normal maps names found in trk file and in shd files of each folder
+        self._trk_normal_maps:Optional[Set[str]] = None
+        self._shd_normal_maps:Dict[str, Set[str]] = {}
+        self._normal = args.normal
+        if self._normal and numpy is None:
+            self.logger.warning('numpy is required for compressing normal maps, normal mode disabled')
+            self._normal = False
 
     def _fn_filter(self, path:str):
         ''' Filter input files matching with expected source extension only
@@ -299,6 +828,15 @@ class Converter:
                     break
         return res
 
+    @staticmethod
+    def _shader_source(texture:TextureInfo) -> Tuple[str, str]:
+        ''' Path of the shd file of given texture, and path of the file its
+        content comes from: the shd file itself, or the texture if the shd
+        file is generated '''
+        # Initialize shader file with same name as out file
+        shd_out = os.path.join(texture.path, f'{texture.out.basename}.shd')
+        return shd_out, shd_out if os.path.exists(shd_out) else texture.source.path
+
     def replace_in_shaders(self, texture:TextureInfo, shader_content=SHADER_CONTENT):
         ''' Replace filename in shd files, generate new shd if necessary'''
         # shd option must be enabled
@@ -306,40 +844,95 @@ class Converter:
             self.logger.info(f'  Checking file names in shader files...')
             fin = texture.source
             fout = texture.out
-            # Initialize shader file with same name as out file
-            shd_out_short = f'{fout.basename}.shd'
-            shd_out = os.path.join(texture.path, shd_out_short)
-            if not os.path.exists(shd_out):
-                # Create missing shader file
-                with open(shd_out, 'w') as fshd:
-                    self.logger.debug(f'    -> "{shd_out_short}" created')
-                    fshd.write(shader_content.format(fout.path))
+            shd_out, shd_source = self._shader_source(texture)
+            shd_out_short = os.path.basename(shd_out)
+            content = ''
+            if os.path.exists(shd_out):
+                with open(shd_out, 'r') as fshd:
+                    content = fshd.read()
+
+            updated:Optional[str] = None
+            # Missing or empty file
+            if len(content) == 0:
+                updated = shader_content.format(fout.filename)
+                self.logger.debug(f'    -> "{shd_out_short}" created')
+            # Already up to date
+            elif fout.filename in content:
+                self.logger.info('    -> OK')
+            # Replace any existing filename with new output filename
+            elif RE_REPLACE_SHD_FN.search(content):
+                updated = RE_REPLACE_SHD_FN.sub(f'map = {fout.filename}', content)
+                self.logger.debug(f'''    -> "{fin.filename}" replaced with
+                    "{fout.filename}" in "{shd_out_short}"''')
             else:
-                # Update
-                with open(shd_out, 'r+') as fshd:
-                    content:str = fshd.read()
-                    # Empty file
-                    if len(content) == 0:
-                        fshd.write(shader_content.format(fout.path))
-                    # Already up to date
-                    elif fout.filename in content:
-                        self.logger.info('    -> OK')
-                    # Replace any existing filename with new output filename
-                    elif RE_REPLACE_SHD_FN.match(content):
-                        content = RE_REPLACE_SHD_FN.sub('map = \1', fout.filename)
-                        self.logger.debug(f'''    -> "{fin.filename}" replaced with
-                            "{fout.filename}" in "{shd_out_short}"''')
-                        fshd.write(content)
-                    elif fout.filename not in content:
-                        self.logger.warning(f'''{fout.filename} not found in {shd_out_short}
-                            or format is not valid''')
+                self.logger.warning(f'''{fout.filename} not found in {shd_out_short}
+                    or format is not valid''')
+
+            if self._package is not None:
+                # Shader files always go with their texture in the package
+                self._package.write(self._package.entry_name(shd_out),
+                    updated or content, source=shd_source)
+            elif updated is not None:
+                with open(shd_out, 'w') as fshd:
+                    fshd.write(updated)
             self.logger.info('')
 
-    def replace_in_track_builder_project(self, textures:Sequence[TextureInfo]):
+    @property
+    def trk_path(self) -> str:
+        trk_path = self.args.trk
+        if not os.path.isabs(trk_path):
+            trk_path = os.path.join(self.working_dir, trk_path)
+        return trk_path
+
+    def _normal_maps_in_track_builder_project(self) -> Set[str]:
+        ''' Names, in lower case without extension, of the normal maps of the
+        Track Builder project '''
+        if self._trk_normal_maps is None:
+            self._trk_normal_maps = set()
+            if len(self.args.trk) > 0 and os.path.exists(self.trk_path):
+                with open(self.trk_path, 'r') as ftrk:
+                    prj = json.loads(ftrk.read())
+                for tl in prj.get('TextureLayers', []):
+                    normal = (tl.get('NormalMap') or {}).get('Map')
+                    if normal:
+                        self._trk_normal_maps.add(
+                            os.path.splitext(ntpath.basename(normal))[0].lower())
+        return self._trk_normal_maps
+
+    def _normal_maps_in_shaders(self, folder:str) -> Set[str]:
+        ''' Names, in lower case without extension, of the bump maps of the shd
+        files of given folder '''
+        if folder not in self._shd_normal_maps:
+            names = set()
+            for f in os.listdir(folder):
+                if not f.lower().endswith('.shd'):
+                    continue
+                with open(os.path.join(folder, f), 'r') as fshd:
+                    m = RE_SHD_BUMP_MAP.search(fshd.read())
+                if m is None:
+                    continue
+                name = os.path.splitext(ntpath.basename(m.group(1)))[0].lower()
+                # shd files created by replace_in_shaders use their own texture as bump map
+                if name != os.path.splitext(f)[0].lower():
+                    names.add(name)
+            self._shd_normal_maps[folder] = names
+        return self._shd_normal_maps[folder]
+
+    def is_normal_map(self, texture:TextureInfo) -> bool:
+        ''' Indicates if texture is a normal map to be compressed in BC5, in
+        normal mode only '''
+        if not self._normal or not texture.out.filename.lower().endswith('.dds'):
+            return False
+        names = set([texture.source.basename.lower(), texture.out.basename.lower()])
+        if len(names & self._normal_maps_in_track_builder_project()) > 0:
+            return True
+        if len(names & self._normal_maps_in_shaders(texture.path)) > 0:
+            return True
+        return any([p.search(texture.source.basename) for p in self.args.normal_patterns])
+
+    def replace_in_track_builder_project(self, textures:Iterable[TextureInfo]):
         if len(self.args.trk) > 0:
-            trk_path = self.args.trk
-            if not os.path.isabs(trk_path):
-                trk_path = os.path.join(self.working_dir, trk_path)
+            trk_path = self.trk_path
             if not os.path.exists(trk_path):
                 logging.warning(f"{trk_path} doesn't exists, skipped")
             else:
@@ -378,91 +971,276 @@ class Converter:
 
             self.logger.info('')
 
-    def convert(self) -> Results:
+    def open_report(self) -> Optional[IO[str]]:
+        ''' Stream where texture results are written, if args.report is set '''
+        if len(self.args.report) == 0:
+            return None
+        report_path = self.args.report
+        if not os.path.isabs(report_path):
+            report_path = os.path.join(self.working_dir, report_path)
+        return open(report_path, 'w')
 
-        self.logger.info(f'Start compressing files.')
-        self.logger.info(f' Alpha mode {self.args.alpha}')
-        start = time.time()
+    def open_package(self) -> Optional[Package]:
+        ''' Package where output files are written, if args.package is set '''
+        if len(self.args.package) == 0:
+            return None
+        package_path = self.args.package
+        if not os.path.isabs(package_path):
+            package_path = os.path.join(self.working_dir, package_path)
+        return Package(package_path, root=self.args.package_root or self.working_dir,
+            compression=self.args.package_compression)
+
+    def _save_on_disk(self, img:Image, texture:TextureInfo, normal:bool=False) -> bool:
+        ''' Write converted image next to its source. Return True if written
+        successfully '''
+        output = texture.out.path
+        try:
+            if normal:
+                # Written in a temporary file first, so a failed conversion
+                # leaves no truncated file to be skipped by lazy mode
+                tmp = f'{output}.tmp'
+                try:
+                    with open(tmp, 'wb') as fdds:
+                        write_bc5_dds(img, fdds)
+                    os.replace(tmp, output)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+            else:
+                img.save(filename=output)
+            self.logger.debug(f'{output} written successfully !')
+        except Exception as e:
+            self.logger.error(f'{texture.source.filename} conversion to {output} failed: {e}')
+            return False
+        return os.path.exists(output)
+
+    def _encoding(self, normal:bool=False) -> dict:
+        ''' Settings a texture is encoded with, indexed with package entries '''
+        return {'compression': list(self.args.compression), 'alpha': self.args.alpha,
+            'normal': normal}
+
+    def _save_in_package(self, img:Image, texture:TextureInfo, normal:bool=False) -> bool:
+        ''' Write converted image directly in the package, without writing
+        it on disk. Return True if written successfully '''
+        name = self._package.entry_name(texture.out.path)
+        try:
+            # Converted in memory first, so a failed conversion leaves nothing
+            # in the package
+            if normal:
+                fdds = io.BytesIO()
+                write_bc5_dds(img, fdds)
+                data = fdds.getvalue()
+            else:
+                data = img.make_blob(format=os.path.splitext(texture.out.filename)[1][1:])
+            self._package.write(name, data, source=texture.source.path,
+                encoding=self._encoding(normal))
+            self.logger.debug(f'{name} written successfully in {self._package.path} !')
+            return True
+        except Exception as e:
+            self.logger.error(f'{texture.source.filename} conversion to {name} failed: {e}')
+            return False
+
+    def list_textures(self, path:str) -> List[TextureInfo]:
+        ''' Get list of textures to process in given folder '''
+        files = list(filter(self._fn_filter, os.listdir(path)))
+        return list([
+            TextureInfo(source=PathInfo(
+                os.path.join(path, f)),
+                output_suffix='_opt'
+            )
+            for f in files
+        ])
 
-        res = Results()
+    def convert_texture(self, texture:TextureInfo, res:Results) -> str:
+        ''' Convert a single texture, add it to given results. Return the
+        status of the conversion '''
+        pin = texture.source
+        normal = self.is_normal_map(texture)
+        if self._package is not None:
+            try:
+                name = self._package.entry_name(texture.out.path)
+            except ValueError as e:
+                self.logger.error(f'{pin.filename} not converted: {e}')
+                return res.add(WITH_ERRORS, texture)
+            if self._package.is_up_to_date(name, pin.path, self._encoding(normal)):
+                self.logger.debug(f'{texture.out.filename} skipped as it is up to date in package')
+                if self.args.shd:
+                    shd_out, shd_source = self._shader_source(texture)
+                    if not self._package.is_up_to_date(self._package.entry_name(shd_out), shd_source):
+                        self.replace_in_shaders(texture)
+                return res.add(SKIPPED, texture)
+        self.logger.info(f'opening image {pin.path}')
+        with Image(filename=pin.path) as img:
+            self.logger.info(f'Processing {pin.filename}...')
+            self.logger.debug(f'  Image size: {img.size}')
+            self.logger.debug(f'  File size: {get_file_size(pin.path)}')
+            with img.clone() as i:
+                if normal:
+                    # BC5 is not supported by Wand, written by write_bc5_dds
+                    compression = NORMAL_COMPRESSION
+                elif 'auto' == self.args.alpha:
+                    has_alpha = i.alpha_channel
+                    compression = self.args.compression[1] if has_alpha else self.args.compression[0]
+                # force off only ?
+                elif 'off' == self.args.alpha:
+                    i.alpha_channel = False
+                if not normal:
+                    i.compression = compression
+                pout = texture.out
+                output = pout.path
+                # In package mode, the package index is used instead of files on disk
+                if self.args.lazy and self._package is None and pout.exists:
+                    self.logger.debug(f'{pout.filename} skipped as it already exists (lazy)')
+                    return res.add(SKIPPED, texture)
+                else:
+                    # For an unkown reason, the image is flipped vertically when
+                    # converted to dds. So we flip the image here for compensating
+                    # this "bug"
+                    i.flip()
+                    if self._package is not None:
+                        written = self._save_in_package(i, texture, normal)
+                    else:
+                        written = self._save_on_disk(i, texture, normal)
+
+                    if written:
+                        in_size = os.path.getsize(pin.path)
+                        if self._package is not None:
+                            out_size = self._package.size(self._package.entry_name(output))
+                        else:
+                            out_size = os.path.getsize(output)
+                        self.logger.info(f'  Compressed successfully to:')
+                        self.logger.info(f'    -> {pout.filename} ({compression})')
+                        self.logger.debug(f'    Size {file_size_to_string(out_size)} ({out_size/in_size*100:.2f}%)')
+                        self.logger.debug('')
+                        self.replace_in_shaders(texture)
+                        return res.add(PROCESSED, texture, in_size, out_size)
+                    else:
+                        self.logger.error((f'DDS file {output} not found on disk after convertion'))
+                        return res.add(WITH_ERRORS, texture)
+
+    def enqueue(self, queue:WorkQueue) -> int:
+        ''' Add textures found in args.paths to given work queue '''
+        if len(self.args.package) > 0:
+            raise ValueError('Package output is not supported in queue mode')
+        nb_added = 0
         for path in self.args.paths:
-            self.logger.debug(path)
             if path.endswith('"'):
                 path = path.replace('"', '')
+            nb_added += queue.put([t.source.path for t in self.list_textures(path)])
+        self.logger.info(f'{nb_added} textures added to queue {queue.path}')
+        return nb_added
 
-            # Get list of files to process
-            files = list(filter(self._fn_filter, os.listdir(path)))
-            textures = list([
-                TextureInfo(source=PathInfo(
-                    os.path.join(path, f)),
-                    output_suffix='_opt'
-                )
-                for f in files
-            ])
-            self.logger.info(f'Processing folder {path}')
-            ''' Convert list of files to dds '''
-            for texture in textures:
-                pin = texture.source
-                self.logger.info(f'opening image {pin.path}')
-                with Image(filename=pin.path) as img:
-                    self.logger.info(f'Processing {pin.filename}...')
-                    self.logger.debug(f'  Image size: {img.size}')
-                    self.logger.debug(f'  File size: {get_file_size(pin.path)}')
-                    with img.clone() as i:
-                        if 'auto' == self.args.alpha:
-                            has_alpha = i.alpha_channel
-                            compression = self.args.compression[1] if has_alpha else self.args.compression[0]
-                        # force off only ?
-                        elif 'off' == self.args.alpha:
-                            i.alpha_channel = False
-                        i.compression = compression
-                        pout = texture.out
-                        output = pout.path
-                        if self.args.lazy and pout.exists():
-                            self.logger.debug(f'{pout.filename} skipped as it already exists (lazy)')
-                            res.skipped.append(texture)
-                        else:
-                            # For an unkown reason, the image is flipped vertically when
-                            # converted to dds. So we flip the image here for compensating
-                            # this "bug"
-                            i.flip()
-                            try:
-                                i.save(filename=output)
-                                self.logger.debug(f'{output} written successfully !')
-                            except Exception as e:
-                                self.logger.error(f'{pin.filename} conversion to {output} failed: {e}')
-
-                            if os.path.exists(output):
-                                in_size = os.path.getsize(pin.path)
-                                out_size = os.path.getsize(output)
-                                self.logger.info(f'  Compressed successfully to:')
-                                self.logger.info(f'    -> {pout.filename} ({compression})')
-                                self.logger.debug(f'    Size {file_size_to_string(out_size)} ({out_size/in_size*100:.2f}%)')
-                                self.logger.debug('')
-                                res.total_source_size += in_size
-                                res.total_out_size += out_size
-                                self.replace_in_shaders(texture)
-                                res.processed.append(texture)
-                            else:
-                                self.logger.error((f'DDS file {output} not found on disk after convertion'))
-                                res.with_errors.append(texture)
-
-            self.replace_in_track_builder_project(res.processed+res.skipped)
-            self.logger.info(f'TGA 2 DDS compression terminated !')
-            self.logger.info(f'{res.nb_processed} files processed in {time.time() - start:.2f} seconds')
+    def convert_queue(self, queue:WorkQueue, poll:float=5) -> Results:
+        ''' Convert textures claimed from given work queue until all its jobs
+        are done. Return the results of all the workers merged together '''
+        if len(self.args.package) > 0:
+            raise ValueError('Package output is not supported in queue mode')
+        self.logger.info(f'Start compressing files from queue {queue.path}')
+        self.logger.info(f' Worker {queue.worker_id}')
+        start = time.time()
+
+        # Results of the worker are only streamed to the queue. The record of a
+        # job is synced to disk before the job is done, so that workers of other
+        # hosts never see the queue drained with missing records. Records of
+        # jobs recovered after their lease has expired are deduplicated by
+        # WorkQueue.records
+        worker_res = Results(keep_textures=False, report=queue.open_results())
+        while True:
+            claim = queue.claim()
+            if claim is None:
+                if queue.drained:
+                    break
+                # Remaining jobs are claimed by other workers, wait for them
+                # or for their lease to expire
+                nb_recovered = queue.recover()
+                if nb_recovered > 0:
+                    self.logger.warning(f'{nb_recovered} jobs recovered from expired leases')
+                else:
+                    time.sleep(poll)
+                continue
+
+            claimed, job = claim
+            texture = TextureInfo(source=PathInfo(job['source']), output_suffix='_opt')
+            try:
+                self.convert_texture(texture, worker_res)
+            except Exception as e:
+                self.logger.error(f'{texture.source.filename} conversion failed: {e}')
+                worker_res.add(WITH_ERRORS, texture)
+            os.fsync(worker_res.report.fileno())
+            if not queue.complete(claimed):
+                self.logger.warning(f'Lease expired for {texture.source.filename}, job recovered by another worker')
+        worker_res.report.close()
+
+        nb_jobs = sum(worker_res.counts.values())
+        self.logger.info(f'{nb_jobs} jobs done by worker {queue.worker_id} in {time.time() - start:.2f} seconds')
+        res = queue.results(keep_textures=len(self.args.report) == 0)
+        # The first worker to see the queue drained updates the project
+        if queue.write_report(res):
+            if res.keep_textures:
+                self.replace_in_track_builder_project(res.processed+res.skipped)
+            else:
+                self.replace_in_track_builder_project(r.to_texture()
+                    for r in queue.records() if r.status != WITH_ERRORS)
+            if len(self.args.report) > 0:
+                # Records of all the workers, merged once the queue is drained
+                with self.open_report() as freport:
+                    for r in queue.records():
+                        freport.write(json.dumps(r.to_dict()) + '\n')
+            self.logger.info(f'Queue report written in {queue.path}')
+            self.logger.info(f'{res.nb_processed} files processed, {res.nb_skipped} skipped, {res.nb_errors} errors')
             if(res.total_out_size > 0):
-                self.logger.info(f'Total TGA size: {res.total_out_size_string}')
-                self.logger.info(f'Total DDS size: {res.total_source_size_string}')
+                self.logger.info(f'Total TGA size: {res.total_source_size_string}')
+                self.logger.info(f'Total DDS size: {res.total_out_size_string}')
                 self.logger.info(f'Saved space {res.saved_string}')
-            self.logger.info(f'')
+        self.logger.info(f'')
+
+        return res
+
+    def convert(self) -> Results:
+
+        self.logger.info(f'Start compressing files.')
+        self.logger.info(f' Alpha mode {self.args.alpha}')
+        start = time.time()
+
+        with (self.open_report() or contextlib.nullcontext()) as freport, \
+                (self.open_package() or contextlib.nullcontext()) as self._package:
+            res = Results(keep_textures=freport is None, report=freport)
+            for path in self.args.paths:
+                self.logger.debug(path)
+                if path.endswith('"'):
+                    path = path.replace('"', '')
+
+                textures = self.list_textures(path)
+                self.logger.info(f'Processing folder {path}')
+                ''' Convert list of files to dds '''
+                converted = []
+                for texture in textures:
+                    if self.convert_texture(texture, res) != WITH_ERRORS:
+                        converted.append(texture)
+
+                self.replace_in_track_builder_project(converted)
+                self.logger.info(f'TGA 2 DDS compression terminated !')
+                self.logger.info(f'{res.nb_processed} files processed in {time.time() - start:.2f} seconds')
+                if(res.total_out_size > 0):
+                    self.logger.info(f'Total TGA size: {res.total_out_size_string}')
+                    self.logger.info(f'Total DDS size: {res.total_source_size_string}')
+                    self.logger.info(f'Saved space {res.saved_string}')
+                self.logger.info(f'')
+        self._package = None
+        res.report = None
 
         return res
 
 def main():
     ''' '''
     args = command_line(create_logger())
-    c = Converter(args, args.path[0])
-    c.convert()
+    c = Converter(args, args.paths[0])
+    if len(args.queue) > 0:
+        queue = WorkQueue(args.queue, worker_id=args.worker_id, lease=args.lease)
+        c.enqueue(queue)
+        c.convert_queue(queue)
+    else:
+        c.convert()
 
 if __name__ == "__main__":
     ''' Entry point '''